@@ -1,9 +1,13 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, g, make_response, get_flashed_messages
 from flask_sqlalchemy import SQLAlchemy
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime, timedelta
 from functools import wraps
 from sqlalchemy import func, extract
+from collections import defaultdict
+import codecs
+import csv
+import hashlib
 import os
 import sys
 
@@ -19,7 +23,7 @@ app = Flask(
     static_folder=resource_path("static")
 )
 app.config['SECRET_KEY'] = 'your-secret-key-here-change-in-production'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + resource_path('inventory.db')
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///' + resource_path('inventory.db'))
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
 db = SQLAlchemy(app)
@@ -93,16 +97,42 @@ class EasyPaisa(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     transaction_type = db.Column(db.String(50), nullable=False)  # Withdraw or Transfer
     client_name = db.Column(db.String(200), nullable=False)
-    phone_number = db.Column(db.String(20), nullable=False)
+    phone_number = db.Column(db.String(20), nullable=False, index=True)
     total_amount = db.Column(db.Float, nullable=False)
     profit_amount = db.Column(db.Float, nullable=False)
-    transaction_date = db.Column(db.DateTime, default=datetime.utcnow)
+    transaction_date = db.Column(db.DateTime, default=datetime.utcnow, index=True)
 
     @property
     def net_amount(self):
         return self.total_amount - self.profit_amount
 
 
+class DataVersion(db.Model):
+    name = db.Column(db.String(50), primary_key=True)  # 'global' or a table name
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+DATA_VERSION_NAMES = ('global', Inventory.__tablename__, Sale.__tablename__,
+                      Expense.__tablename__, EasyPaisa.__tablename__)
+
+
+def bump_data_version(*models):
+    """Bump the global and per-table versions; call before db.session.commit()"""
+    names = ['global'] + [model.__tablename__ for model in models]
+    updated = DataVersion.query.filter(DataVersion.name.in_(names)).update({
+        DataVersion.version: DataVersion.version + 1,
+        DataVersion.updated_at: datetime.utcnow()
+    }, synchronize_session=False)
+
+    # Databases that never ran init_db() have no counter rows yet
+    if updated < len(names):
+        existing = {name for (name,) in db.session.query(DataVersion.name).filter(DataVersion.name.in_(names))}
+        for name in names:
+            if name not in existing:
+                db.session.add(DataVersion(name=name, version=1, updated_at=datetime.utcnow()))
+
+
 # Login required decorator
 def login_required(f):
     @wraps(f)
@@ -114,6 +144,45 @@ def login_required(f):
     return decorated_function
 
 
+# Conditional GET decorator for pages that only change when the given tables do
+def data_versioned(*models):
+    names = [model.__tablename__ for model in models]
+
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            rows = DataVersion.query.filter(DataVersion.name.in_(names)).all()
+            versions = {row.name: row.version for row in rows}
+            # Default date ranges follow today's date, so it is part of the tag too
+            key = '|'.join([request.full_path, session.get('username', ''), datetime.now().strftime('%Y-%m-%d')] +
+                           ['{}={}'.format(name, versions.get(name, 0)) for name in names])
+            etag = hashlib.sha1(key.encode('utf-8')).hexdigest()
+            updated = [row.updated_at for row in rows if row.updated_at]
+            last_modified = max(updated) if updated else None
+
+            # Pending flash messages must be rendered, so never answer 304 over them.
+            # Neither can a tag built on a missing counter, which may be recreated later.
+            flashes_pending = '_flashes' in session
+            if not flashes_pending and len(rows) == len(names) and request.if_none_match.contains(etag):
+                response = make_response('', 304)
+            else:
+                g.data_versions = {name: versions.get(name, 0) for name in names}
+                response = make_response(f(*args, **kwargs))
+                # A body showing one-time flashes must never be cached or revalidated,
+                # including flashes raised by the view itself
+                if flashes_pending or ('_flashes' not in session and get_flashed_messages()):
+                    response.cache_control.no_store = True
+                    return response
+
+            response.set_etag(etag)
+            response.last_modified = last_modified
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+            return response
+        return decorated_function
+    return decorator
+
+
 # Routes
 @app.route('/')
 @login_required
@@ -149,6 +218,7 @@ def logout():
 
 @app.route('/dashboard')
 @login_required
+@data_versioned(Inventory, Sale, Expense)
 def dashboard():
     # Get date range from query params
     start_date = request.args.get('start_date')
@@ -232,6 +302,7 @@ def dashboard():
 
 @app.route('/inventory')
 @login_required
+@data_versioned(Inventory)
 def inventory():
     # Get search and filter parameters
     search_query = request.args.get('search', '').strip()
@@ -270,6 +341,7 @@ def add_inventory():
             supplier=request.form.get('supplier')
         )
         db.session.add(item)
+        bump_data_version(Inventory)
         db.session.commit()
         flash('Item added successfully!', 'success')
         return redirect(url_for('inventory'))
@@ -295,6 +367,7 @@ def edit_inventory(id):
         item.quantity = int(request.form.get('quantity'))
         item.supplier = request.form.get('supplier')
         
+        bump_data_version(Inventory)
         db.session.commit()
         flash('Item updated successfully!', 'success')
         return redirect(url_for('inventory'))
@@ -307,6 +380,7 @@ def edit_inventory(id):
 def delete_inventory(id):
     item = Inventory.query.get_or_404(id)
     db.session.delete(item)
+    bump_data_version(Inventory, Sale)
     db.session.commit()
     flash('Item deleted successfully!', 'success')
     return redirect(url_for('inventory'))
@@ -314,6 +388,7 @@ def delete_inventory(id):
 
 @app.route('/sales')
 @login_required
+@data_versioned(Sale, Inventory)
 def sales():
     # Get date filter parameters
     start_date = request.args.get('start_date')
@@ -372,6 +447,7 @@ def add_sale():
         item.quantity -= quantity_sold
         
         db.session.add(sale)
+        bump_data_version(Sale, Inventory)
         db.session.commit()
         
         flash('Sale recorded successfully!', 'success')
@@ -394,6 +470,7 @@ def api_add_inventory():
             supplier=data.get('supplier', '')
         )
         db.session.add(item)
+        bump_data_version(Inventory)
         db.session.commit()
         return jsonify({
             'success': True,
@@ -429,8 +506,25 @@ def search_inventory():
     } for item in items])
 
 
+@app.route('/api/data-version')
+@login_required
+def api_data_version():
+    # Auto-refresh polls here; the global counter lets an idle shop answer 304
+    versions = {row.name: row.version for row in DataVersion.query.all()}
+    etag = 'global-{}'.format(versions.get('global', 0))
+    if request.if_none_match.contains(etag):
+        response = make_response('', 304)
+    else:
+        response = jsonify(versions)
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
 @app.route('/expenses')
 @login_required
+@data_versioned(Expense)
 def expenses():
     all_expenses = Expense.query.order_by(Expense.expense_date.desc()).all()
     return render_template('expenses.html', expenses=all_expenses)
@@ -447,6 +541,7 @@ def add_expense():
             expense_date=datetime.strptime(request.form.get('expense_date'), '%Y-%m-%d')
         )
         db.session.add(expense)
+        bump_data_version(Expense)
         db.session.commit()
         flash('Expense added successfully!', 'success')
         return redirect(url_for('expenses'))
@@ -460,6 +555,7 @@ def add_expense():
 def delete_expense(id):
     expense = Expense.query.get_or_404(id)
     db.session.delete(expense)
+    bump_data_version(Expense)
     db.session.commit()
     flash('Expense deleted successfully!', 'success')
     return redirect(url_for('expenses'))
@@ -467,6 +563,7 @@ def delete_expense(id):
 
 @app.route('/revenue')
 @login_required
+@data_versioned(Sale, Inventory, Expense)
 def revenue():
     # Get date range
     start_date = request.args.get('start_date')
@@ -515,6 +612,7 @@ def revenue():
 
 @app.route('/reports')
 @login_required
+@data_versioned(Sale, Inventory)
 def reports():
     # Get date range
     start_date = request.args.get('start_date')
@@ -576,6 +674,7 @@ def reports():
 
 @app.route('/easypaisa')
 @login_required
+@data_versioned(EasyPaisa)
 def easypaisa():
     # Get date filter parameters
     start_date = request.args.get('start_date')
@@ -652,6 +751,7 @@ def add_easypaisa():
             profit_amount=float(request.form.get('profit_amount'))
         )
         db.session.add(transaction)
+        bump_data_version(EasyPaisa)
         db.session.commit()
         flash('Easy Paisa transaction added successfully!', 'success')
         return redirect(url_for('easypaisa'))
@@ -664,16 +764,255 @@ def add_easypaisa():
 def delete_easypaisa(id):
     transaction = EasyPaisa.query.get_or_404(id)
     db.session.delete(transaction)
+    bump_data_version(EasyPaisa)
     db.session.commit()
     flash('Transaction deleted successfully!', 'success')
     return redirect(url_for('easypaisa'))
 
 
+# Easy Paisa statement reconciliation
+RECONCILE_CHUNK_SIZE = 2000  # Statement lines joined per database read
+RECONCILE_WINDOW_MINUTES = 30  # Allowed gap between statement and ledger times
+RECONCILE_DETAIL_LIMIT = 500  # Rows listed per result table, counts stay exact
+STATEMENT_UTC_OFFSET_HOURS = 5  # Statements are in PKT, ledger times are UTC
+STATEMENT_COLUMNS = ('transaction_id', 'transaction_date', 'phone_number', 'amount')
+STATEMENT_DATE_FORMATS = ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%d/%m/%Y %H:%M:%S', '%d/%m/%Y %H:%M')
+SAMPLE_STATEMENT_PATH = resource_path(os.path.join('fixtures', 'easypaisa_statement.csv'))
+
+
+def normalize_phone(phone_number):
+    """Reduce 0300-1234567, 923001234567, +92 300 1234567 and 0092 300 1234567 to 03001234567"""
+    digits = ''.join(c for c in phone_number if c.isdigit())
+    if digits.startswith('00'):
+        digits = digits[2:]
+    if digits.startswith('92'):
+        digits = '0' + digits[2:]
+    return digits
+
+
+def parse_statement_date(value):
+    value = value.strip()
+    for date_format in STATEMENT_DATE_FORMATS:
+        try:
+            return datetime.strptime(value, date_format)
+        except ValueError:
+            continue
+    raise ValueError('Unrecognised date: {}'.format(value))
+
+
+def record_result(result, key, row):
+    result[key]['count'] += 1
+    if len(result[key]['rows']) < RECONCILE_DETAIL_LIMIT:
+        result[key]['rows'].append(row)
+
+
+def closest_unused(candidates, when, used_ids, window):
+    best = None
+    for candidate in candidates:
+        gap = abs(candidate['date'] - when)
+        if candidate['id'] in used_ids or gap > window:
+            continue
+        if best is None or gap < abs(best['date'] - when):
+            best = candidate
+    return best
+
+
+def reconcile_chunk(chunk, result, used_ids, final=True):
+    """Hash-join one batch of statement lines against the ledger rows in its time range
+
+    Returns the unmatched lines held back to retry with the next batch.
+    """
+    window = timedelta(minutes=RECONCILE_WINDOW_MINUTES)
+    start_dt = min(entry['date'] for entry in chunk) - window
+    end_dt = max(entry['date'] for entry in chunk) + window
+
+    ledger_rows = db.session.query(
+        EasyPaisa.id, EasyPaisa.client_name, EasyPaisa.phone_number,
+        EasyPaisa.total_amount, EasyPaisa.transaction_date
+    ).filter(EasyPaisa.transaction_date.between(start_dt, end_dt)).all()
+
+    by_key = defaultdict(list)
+    by_phone = defaultdict(list)
+    for row in ledger_rows:
+        if row.id in used_ids:
+            continue
+        candidate = {
+            'id': row.id,
+            'client_name': row.client_name,
+            'phone': normalize_phone(row.phone_number),
+            'amount': int(round(row.total_amount * 100)),
+            'date': row.transaction_date
+        }
+        by_key[(candidate['phone'], candidate['amount'])].append(candidate)
+        by_phone[candidate['phone']].append(candidate)
+
+    # Exact matches first, so a mismatch never takes a row another line matches exactly
+    unmatched = []
+    for entry in chunk:
+        match = closest_unused(by_key.get((entry['phone'], entry['amount']), ()), entry['date'], used_ids, window)
+        if match:
+            used_ids.add(match['id'])
+            result['matched'] += 1
+        else:
+            unmatched.append(entry)
+
+    # A mismatch takes a ledger row up to one window from its line, and a later
+    # line can match that row exactly from one window further on. Lines that
+    # close to the batch end wait for the next batch's exact matches.
+    held_back = []
+    if not final:
+        cutoff = max(entry['date'] for entry in chunk) - 2 * window
+        held_back = [entry for entry in unmatched if entry['date'] >= cutoff]
+        unmatched = [entry for entry in unmatched if entry['date'] < cutoff]
+
+    for entry in unmatched:
+        near = closest_unused(by_phone.get(entry['phone'], ()), entry['date'], used_ids, window)
+        if near:
+            used_ids.add(near['id'])
+            record_result(result, 'mismatched', {
+                'line': entry['line'],
+                'reference': entry['reference'],
+                'phone': entry['phone'],
+                'date': entry['date'],
+                'statement_amount': entry['amount'] / 100,
+                'ledger_id': near['id'],
+                'client_name': near['client_name'],
+                'ledger_amount': near['amount'] / 100
+            })
+        else:
+            record_result(result, 'missing_in_ledger', {
+                'line': entry['line'],
+                'reference': entry['reference'],
+                'phone': entry['phone'],
+                'date': entry['date'],
+                'amount': entry['amount'] / 100
+            })
+
+    return held_back
+
+
+def reconcile_statement(lines):
+    """Stream a provider statement CSV and reconcile it against EasyPaisa rows
+
+    Lines are joined in batches of RECONCILE_CHUNK_SIZE, so memory holds one batch
+    of statement lines plus the ledger rows in its time range. Only the ids of
+    consumed ledger rows and the unmatched lines near the end of the previous
+    batch are kept across batches. Statements are expected in time order.
+    """
+    reader = csv.DictReader(lines)
+    missing_columns = [c for c in STATEMENT_COLUMNS if c not in (reader.fieldnames or [])]
+    if missing_columns:
+        raise ValueError('Statement is missing columns: {}'.format(', '.join(missing_columns)))
+
+    result = {
+        'lines': 0,
+        'matched': 0,
+        'mismatched': {'count': 0, 'rows': []},
+        'missing_in_ledger': {'count': 0, 'rows': []},
+        'missing_in_statement': {'count': 0, 'rows': []},
+        'invalid': {'count': 0, 'rows': []},
+        'start_date': None,
+        'end_date': None
+    }
+    used_ids = set()
+    offset = timedelta(hours=STATEMENT_UTC_OFFSET_HOURS)
+    chunk = []
+    carried = 0
+
+    for line_no, row in enumerate(reader, start=2):
+        result['lines'] += 1
+        try:
+            entry = {
+                'line': line_no,
+                'reference': (row['transaction_id'] or '').strip(),
+                'phone': normalize_phone(row['phone_number'] or ''),
+                'amount': int(round(float(row['amount']) * 100)),
+                'date': parse_statement_date(row['transaction_date'] or '') - offset
+            }
+        except (TypeError, ValueError):
+            record_result(result, 'invalid', {'line': line_no})
+            continue
+
+        if result['start_date'] is None or entry['date'] < result['start_date']:
+            result['start_date'] = entry['date']
+        if result['end_date'] is None or entry['date'] > result['end_date']:
+            result['end_date'] = entry['date']
+
+        chunk.append(entry)
+        if len(chunk) - carried >= RECONCILE_CHUNK_SIZE:
+            chunk = reconcile_chunk(chunk, result, used_ids, final=False)
+            carried = len(chunk)
+
+    if chunk:
+        reconcile_chunk(chunk, result, used_ids)
+
+    # Ledger rows inside the statement period that nothing on the statement accounts for
+    if result['start_date'] is not None:
+        period_rows = db.session.query(
+            EasyPaisa.id, EasyPaisa.client_name, EasyPaisa.phone_number,
+            EasyPaisa.total_amount, EasyPaisa.transaction_date
+        ).filter(
+            EasyPaisa.transaction_date.between(result['start_date'], result['end_date'])
+        ).order_by(EasyPaisa.transaction_date).yield_per(RECONCILE_CHUNK_SIZE)
+        for row in period_rows:
+            if row.id not in used_ids:
+                record_result(result, 'missing_in_statement', {
+                    'ledger_id': row.id,
+                    'client_name': row.client_name,
+                    'phone': row.phone_number,
+                    'date': row.transaction_date,
+                    'amount': row.total_amount
+                })
+
+    return result
+
+
+@app.route('/easypaisa/reconcile', methods=['GET', 'POST'])
+@login_required
+def reconcile_easypaisa():
+    result = None
+    source = None
+
+    if request.method == 'POST':
+        statement = request.files.get('statement')
+        try:
+            if statement and statement.filename:
+                source = statement.filename
+                result = reconcile_statement(codecs.iterdecode(statement.stream, 'utf-8-sig'))
+            elif request.form.get('use_sample'):
+                source = os.path.basename(SAMPLE_STATEMENT_PATH)
+                with open(SAMPLE_STATEMENT_PATH, encoding='utf-8-sig', newline='') as f:
+                    result = reconcile_statement(f)
+            else:
+                flash('Please choose a statement CSV file.', 'warning')
+                return redirect(url_for('reconcile_easypaisa'))
+        except (ValueError, csv.Error) as e:
+            flash('Could not read statement: {}'.format(e), 'danger')
+            return redirect(url_for('reconcile_easypaisa'))
+
+    return render_template('reconcile_easypaisa.html',
+                         result=result,
+                         source=source,
+                         window_minutes=RECONCILE_WINDOW_MINUTES,
+                         detail_limit=RECONCILE_DETAIL_LIMIT)
+
+
 def init_db():
     """Initialize database and create admin user if not exists"""
     with app.app_context():
         db.create_all()
         
+        # create_all skips existing tables, so add indexes missing from older databases
+        for index in EasyPaisa.__table__.indexes:
+            index.create(db.engine, checkfirst=True)
+        
+        # Seed the data version counters bumped by write routes
+        existing = {row.name for row in DataVersion.query.all()}
+        for name in DATA_VERSION_NAMES:
+            if name not in existing:
+                db.session.add(DataVersion(name=name, version=0))
+        db.session.commit()
+        
         # Create admin user if doesn't exist
         if not User.query.filter_by(username='admin').first():
             admin = User(username='admin')
@@ -0,0 +1,28 @@
+import os
+import sys
+
+import pytest
+
+os.environ['DATABASE_URL'] = 'sqlite://'
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import app as shop  # noqa: E402
+
+
+@pytest.fixture
+def ctx():
+    with shop.app.app_context():
+        shop.db.create_all()
+        yield shop
+        shop.db.session.remove()
+        shop.db.drop_all()
+
+
+@pytest.fixture
+def client(ctx):
+    ctx.init_db()
+    client = ctx.app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = 1
+        sess['username'] = 'admin'
+    return client
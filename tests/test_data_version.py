@@ -0,0 +1,118 @@
+def etag_of(client, path):
+    response = client.get(path)
+    assert response.status_code == 200
+    return response.headers['ETag']
+
+
+def add_expense(client):
+    return client.post('/expenses/add', data={
+        'title': 'Rent',
+        'category': 'Rent',
+        'amount': '5000',
+        'expense_date': '2025-01-10'
+    })
+
+
+def test_matching_if_none_match_returns_empty_304(client):
+    etag = etag_of(client, '/sales')
+
+    response = client.get('/sales', headers={'If-None-Match': etag})
+
+    assert response.status_code == 304
+    assert response.data == b''
+    assert response.headers['ETag'] == etag
+
+
+def test_sale_changes_sales_and_dashboard_etags(client, ctx):
+    client.post('/inventory/add', data={
+        'item_name': 'Charger',
+        'category': 'Accessories',
+        'purchase_price': '500',
+        'quantity': '5',
+        'supplier': 'Local'
+    })
+    client.get('/inventory')  # Render the flash left by the redirect
+    sales_etag = etag_of(client, '/sales')
+    dashboard_etag = etag_of(client, '/dashboard')
+
+    client.post('/sales/add', data={
+        'inventory_id': str(ctx.Inventory.query.first().id),
+        'quantity_sold': '1',
+        'selling_price': '800'
+    })
+    client.get('/sales')
+
+    assert etag_of(client, '/sales') != sales_etag
+    assert etag_of(client, '/dashboard') != dashboard_etag
+
+
+def test_untracked_write_keeps_dashboard_etag(client):
+    dashboard_etag = etag_of(client, '/dashboard')
+
+    client.post('/easypaisa/add', data={
+        'transaction_type': 'Withdraw',
+        'client_name': 'Client',
+        'phone_number': '0300-1234567',
+        'total_amount': '1000',
+        'profit_amount': '20'
+    })
+    client.get('/easypaisa')
+
+    response = client.get('/dashboard', headers={'If-None-Match': dashboard_etag})
+    assert response.status_code == 304
+
+
+def test_no_304_while_flash_pending(client):
+    etag = etag_of(client, '/expenses')
+    with client.session_transaction() as sess:
+        sess['_flashes'] = [('info', 'Pending')]
+
+    response = client.get('/expenses', headers={'If-None-Match': etag})
+
+    assert response.status_code == 200
+    assert b'Pending' in response.data
+
+
+def test_rendered_flash_is_not_cached(client):
+    add_expense(client)
+
+    response = client.get('/expenses')
+
+    assert response.status_code == 200
+    assert b'Expense added successfully!' in response.data
+    assert 'ETag' not in response.headers
+    assert 'Last-Modified' not in response.headers
+    assert response.cache_control.no_store
+
+
+def test_flash_raised_by_view_is_not_cached(client):
+    response = client.get('/sales?start_date=bad&end_date=bad')
+
+    assert b'Invalid date format' in response.data
+    assert 'ETag' not in response.headers
+    assert response.cache_control.no_store
+
+
+def test_missing_counter_rows_are_created_on_write(client, ctx):
+    ctx.DataVersion.query.delete()
+    ctx.db.session.commit()
+    etag = etag_of(client, '/expenses')
+    assert client.get('/expenses', headers={'If-None-Match': etag}).status_code == 200
+
+    add_expense(client)
+    client.get('/expenses')
+
+    assert client.get('/expenses', headers={'If-None-Match': etag}).status_code == 200
+    assert ctx.db.session.get(ctx.DataVersion, 'expense').version == 1
+
+
+def test_data_version_endpoint_answers_304_until_a_write(client):
+    response = client.get('/api/data-version')
+    etag = response.headers['ETag']
+    assert client.get('/api/data-version', headers={'If-None-Match': etag}).status_code == 304
+
+    add_expense(client)
+
+    response = client.get('/api/data-version', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.json['expense'] == 1
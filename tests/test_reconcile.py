@@ -0,0 +1,77 @@
+import io
+from datetime import datetime
+
+HEADER = 'transaction_id,transaction_date,transaction_type,phone_number,amount\n'
+
+
+def add_ledger(shop, phone_number, amount, when):
+    shop.db.session.add(shop.EasyPaisa(
+        transaction_type='Withdraw',
+        client_name='Client',
+        phone_number=phone_number,
+        total_amount=amount,
+        profit_amount=0,
+        transaction_date=when
+    ))
+    shop.db.session.commit()
+
+
+def statement(*lines):
+    return io.StringIO(HEADER + ''.join(line + '\n' for line in lines))
+
+
+def test_exact_matches_win_over_earlier_mismatch(ctx):
+    add_ledger(ctx, '0300-1234567', 200, datetime(2025, 1, 10, 10, 0))
+    add_ledger(ctx, '0300-1234567', 100, datetime(2025, 1, 10, 10, 5))
+
+    # Statement times are PKT, five hours ahead of the ledger
+    result = ctx.reconcile_statement(statement(
+        'T1,2025-01-10 15:01:00,Withdraw,923001234567,150',
+        'T2,2025-01-10 15:03:00,Withdraw,923001234567,100',
+        'T3,2025-01-10 15:04:00,Withdraw,923001234567,200',
+    ))
+
+    assert result['matched'] == 2
+    assert result['mismatched']['count'] == 0
+    assert result['missing_in_ledger']['count'] == 1
+    assert result['missing_in_ledger']['rows'][0]['reference'] == 'T1'
+    assert result['missing_in_statement']['count'] == 0
+
+
+def test_mismatch_waits_for_exact_match_in_next_chunk(ctx, monkeypatch):
+    monkeypatch.setattr(ctx, 'RECONCILE_CHUNK_SIZE', 2)
+    add_ledger(ctx, '0311-7654321', 500, datetime(2025, 1, 10, 10, 0))
+    add_ledger(ctx, '0300-1234567', 100, datetime(2025, 1, 10, 10, 10))
+
+    result = ctx.reconcile_statement(statement(
+        'T1,2025-01-10 15:00:00,Withdraw,923117654321,500',
+        'T2,2025-01-10 15:00:00,Withdraw,923001234567,150',
+        'T3,2025-01-10 15:12:00,Withdraw,923001234567,100',
+    ))
+
+    assert result['matched'] == 2
+    assert result['mismatched']['count'] == 0
+    assert result['missing_in_ledger']['count'] == 1
+    assert result['missing_in_ledger']['rows'][0]['reference'] == 'T2'
+
+
+def test_normalize_phone(ctx):
+    for phone_number in ('0300-1234567', '923001234567', '+92 300 1234567', '0092 300 1234567', '00923001234567'):
+        assert ctx.normalize_phone(phone_number) == '03001234567'
+
+
+def test_hold_back_includes_lines_exactly_two_windows_before_batch_end(ctx, monkeypatch):
+    monkeypatch.setattr(ctx, 'RECONCILE_CHUNK_SIZE', 2)
+    add_ledger(ctx, '0300-1234567', 100, datetime(2025, 1, 10, 10, 30))
+    add_ledger(ctx, '0311-7654321', 500, datetime(2025, 1, 10, 11, 0))
+
+    result = ctx.reconcile_statement(statement(
+        'A,2025-01-10 15:00:00,Withdraw,923001234567,150',
+        'B,2025-01-10 16:00:00,Withdraw,923117654321,500',
+        'C,2025-01-10 16:00:00,Withdraw,923001234567,100',
+    ))
+
+    assert result['matched'] == 2
+    assert result['mismatched']['count'] == 0
+    assert result['missing_in_ledger']['count'] == 1
+    assert result['missing_in_ledger']['rows'][0]['reference'] == 'A'